@@ -0,0 +1,117 @@
+import json
+import os
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+BIOMS_PATH = os.environ.get("KIN_BIOMS_CONFIG", os.path.join(DATA_DIR, "bioms.json"))
+SPECIES_PATH = os.environ.get("KIN_SPECIES_CONFIG", os.path.join(DATA_DIR, "species.json"))
+
+# bioms the simulation itself refers to (flooding, fallback for unknown map colors)
+REQUIRED_BIOMS = ("OCEAN", "COASTAL", "ROCK")
+DIETS = ("CARNIVORE", "HERBIVORE", "OMNIVORE")
+
+# relation of a neighbor's species to a critter's own species
+SAME, PREDATOR, PREY, OTHER = 0, 1, 2, 3
+
+def _load(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or not len(data):
+        raise ValueError("{}: expected a non-empty object of definitions".format(path))
+    return data
+
+def _check_number(path, name, values, key, lo=None, hi=None, integer=False):
+    value = values.get(key)
+    if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)):
+        raise ValueError("{}: '{}' needs {} '{}'".format(path, name, "an integer" if integer else "a numeric", key))
+    if (lo is not None and value < lo) or (hi is not None and value > hi):
+        raise ValueError("{}: '{}' has '{}' = {} outside of [{}, {}]".format(path, name, key, value, lo, hi))
+
+def load_bioms(path=BIOMS_PATH) -> dict:
+    bioms = _load(path)
+    for name, values in bioms.items():
+        _check_number(path, name, values, "value", 0, integer=True)
+        for key in ("air_pollution", "ground_pollution", "sealing"):
+            _check_number(path, name, values, key, 0, 1)
+        _check_number(path, name, values, "d_temp")
+        color = values.get("color")
+        if not isinstance(color, list) or len(color) != 3 or not all(isinstance(c, int) and 0 <= c <= 255 for c in color):
+            raise ValueError("{}: '{}' needs an [r, g, b] 'color'".format(path, name))
+        values["color"] = tuple(color)
+    # biom values double as indices into the biom grid and the species tables
+    if sorted(values.get("value") for values in bioms.values()) != list(range(len(bioms))):
+        raise ValueError("{}: biom values must be the integers 0..{}".format(path, len(bioms) - 1))
+    if len({values["color"] for values in bioms.values()}) != len(bioms):
+        raise ValueError("{}: biom colors must be unique to be read from the segmentation map".format(path))
+    missing = [name for name in REQUIRED_BIOMS if name not in bioms]
+    if len(missing):
+        raise ValueError("{}: missing required bioms {}".format(path, missing))
+    return bioms
+
+def load_species(biom_names, path=SPECIES_PATH) -> dict:
+    species = _load(path)
+    for name, values in species.items():
+        if not isinstance(values.get("value"), str):
+            raise ValueError("{}: '{}' needs a string 'value'".format(path, name))
+        for key in ("bioms", "predators"):
+            if not isinstance(values.get(key), list):
+                raise ValueError("{}: '{}' needs a list of '{}'".format(path, name, key))
+        unknown = [biom for biom in values["bioms"] if biom not in biom_names]
+        if len(unknown):
+            raise ValueError("{}: '{}' lives in unknown bioms {}".format(path, name, unknown))
+        unknown = [predator for predator in values["predators"] if predator not in species or predator == name]
+        if len(unknown):
+            raise ValueError("{}: '{}' has unknown predators {}".format(path, name, unknown))
+        if values.get("diet") not in DIETS:
+            raise ValueError("{}: '{}' needs a 'diet' out of {}".format(path, name, DIETS))
+        for key in ("res_air_p", "res_ground_p", "res_sealing"):
+            _check_number(path, name, values, key, 0, 1)
+        _check_number(path, name, values, "max_temp")
+        # compared to whole steps of happiness, see Critter.step
+        _check_number(path, name, values, "reproduction_rate", 0, integer=True)
+        if not isinstance(values.get("color"), str):
+            raise ValueError("{}: '{}' needs a 'color'".format(path, name))
+        if values.get("happinessFunction") is not None and not isinstance(values["happinessFunction"], str):
+            raise ValueError("{}: '{}' needs the name of a happinessFunctions function or null".format(path, name))
+    if len({values["value"] for values in species.values()}) != len(species):
+        raise ValueError("{}: species values must be unique".format(path))
+    return species
+
+class SpeciesTables:
+    species: list
+    species_index: dict
+    habitat: np.ndarray
+    predates: np.ndarray
+    relation: np.ndarray
+    is_carnivore: np.ndarray
+    res_air_p: np.ndarray
+    res_ground_p: np.ndarray
+    res_sealing: np.ndarray
+    max_temp: np.ndarray
+    reproduction_rate: np.ndarray
+    habitat_rows: list
+
+    def __init__(self, species_values: dict, biom_types: list) -> None:
+        self.species = list(species_values)
+        self.species_index = {species: i for i, species in enumerate(self.species)}
+        n = len(self.species)
+        # habitat[species, biom]: the species can live in the biom
+        self.habitat = np.zeros((n, len(biom_types)), dtype=bool)
+        # predates[a, b]: species a hunts species b
+        self.predates = np.zeros((n, n), dtype=bool)
+        for i, species in enumerate(self.species):
+            values = species_values[species]
+            self.habitat[i, [biom_type.value for biom_type in values["bioms"]]] = True
+            for predator in values["predators"]:
+                self.predates[self.species_index[predator], i] = True
+        # relation[a, b]: what a critter of species a makes of a neighbor of species b
+        self.relation = np.full((n, n), OTHER, dtype=np.int8)
+        self.relation[self.predates.T] = PREDATOR
+        self.relation[self.predates & ~self.predates.T] = PREY
+        np.fill_diagonal(self.relation, SAME)
+        self.is_carnivore = np.array([species_values[s]["diet"].name == "CARNIVORE" for s in self.species])
+        for key in ("res_air_p", "res_ground_p", "res_sealing", "max_temp"):
+            setattr(self, key, np.array([species_values[s][key] for s in self.species], dtype=float))
+        self.reproduction_rate = np.array([species_values[s]["reproduction_rate"] for s in self.species], dtype=np.int64)
+        # plain python rows for per-critter lookups, where indexing a list beats indexing an array
+        self.habitat_rows = self.habitat.tolist()
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# modules that only the browser front end needs, a headless run should never pull them in itself
+FRONTEND_MODULES = ("server", "sessions", "run")
+# the visualization stack behind them, which mesa and mesa_geo still import from their own __init__
+VISUALIZATION_MODULES = ("tornado", "folium", "mesa.visualization", "mesa_geo.visualization")
+
+def run(steps: int, **params):
+    from model import KinMaking
+    model = KinMaking(**params)
+    for _ in range(steps):
+        model.step()
+    return model
+
+def import_profile() -> dict:
+    # a fresh interpreter, as every worker process of a sweep starts with one
+    code = (
+        "import json, sys, time; t = time.perf_counter(); import model; t = time.perf_counter() - t; "
+        "print(json.dumps({{'import': t, 'loaded': [name for name in {} if name in sys.modules]}}))"
+    ).format(FRONTEND_MODULES + VISUALIZATION_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def measure_import() -> float:
+    return import_profile()["import"]
+
+def measure_startup(**params) -> dict:
+    profile = import_profile()
+    timings = {"import": profile["import"]}
+    from model import KinMaking
+    t = time.perf_counter()
+    model = KinMaking(**params)
+    timings["init"] = time.perf_counter() - t
+    t = time.perf_counter()
+    model.step()
+    timings["first_tick"] = time.perf_counter() - t
+    timings["frontend_loaded"] = [name for name in profile["loaded"] if name in FRONTEND_MODULES]
+    timings["visualization_loaded"] = [name for name in profile["loaded"] if name in VISUALIZATION_MODULES]
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Making Kin model without the visualization server")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--critters", type=int, default=100)
+    parser.add_argument("--spin-up", type=int, default=0)
+    parser.add_argument("--kernels", default="auto", choices=["auto", "numba", "numpy"])
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="write the collected model data to this csv file")
+    parser.add_argument("--profile-startup", action="store_true", help="print import, init and first tick times as json")
+    args = parser.parse_args(argv)
+    params = {
+        "init_num_critters": args.critters,
+        "spin_up_steps": args.spin_up,
+        "kernel_backend": args.kernels,
+        "seed": args.seed
+    }
+
+    if args.profile_startup:
+        print(json.dumps(measure_startup(**params)))
+        return
+    model = run(args.steps, **params)
+    if args.output is not None:
+        model.datacollector.get_model_vars_dataframe().to_csv(args.output)
+
+if __name__ == "__main__":
+    main()
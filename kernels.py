@@ -0,0 +1,101 @@
+from functools import lru_cache
+import importlib
+import importlib.util
+import math
+import os
+import numpy as np
+
+# actions picked by next_action, see Critter.step
+REPRODUCE, ROAM, DIE, MIGRATE = 0, 1, 2, 3
+
+@lru_cache(maxsize=None)
+def route_offsets(radius: int) -> np.ndarray:
+    # von Neumann neighborhood without the center, in the same (x, y) order as RasterLayer.get_neighborhood
+    offsets = [
+        (dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)
+        if (dx, dy) != (0, 0) and abs(dx) + abs(dy) <= radius
+    ]
+    return np.array(offsets, dtype=np.int64)
+
+def _next_action(is_happy, steps_happy, steps_unhappy, reproduction_rate, max_steps_unhappy):
+    if is_happy:
+        return REPRODUCE if steps_happy > reproduction_rate else ROAM
+    return DIE if steps_unhappy > max_steps_unhappy else MIGRATE
+
+def _classify_neighbors_numpy(relation_row, neighbor_species):
+    return np.bincount(relation_row[neighbor_species], minlength=4)
+
+def _classify_neighbors_loop(relation_row, neighbor_species):
+    counts = np.zeros(4, dtype=np.int64)
+    for species in neighbor_species:
+        counts[relation_row[species]] += 1
+    return counts
+
+def _pick_destination_numpy(habitat_row, biom_grid, x, y, offsets, u_choice):
+    nx = x + offsets[:, 0]
+    ny = y + offsets[:, 1]
+    inside = np.flatnonzero((nx >= 0) & (nx < biom_grid.shape[0]) & (ny >= 0) & (ny < biom_grid.shape[1]))
+    suitable = inside[habitat_row[biom_grid[nx[inside], ny[inside]]]]
+    if not len(suitable):
+        return -1
+    return int(suitable[int(u_choice * len(suitable))])
+
+def _pick_destination_loop(habitat_row, biom_grid, x, y, offsets, u_choice):
+    (width, height) = biom_grid.shape
+    n = 0
+    for i in range(len(offsets)):
+        nx = x + offsets[i, 0]
+        ny = y + offsets[i, 1]
+        if 0 <= nx < width and 0 <= ny < height and habitat_row[biom_grid[nx, ny]]:
+            n += 1
+    k = int(u_choice * n)
+    for i in range(len(offsets)):
+        nx = x + offsets[i, 0]
+        ny = y + offsets[i, 1]
+        if 0 <= nx < width and 0 <= ny < height and habitat_row[biom_grid[nx, ny]]:
+            if k == 0:
+                return i
+            k -= 1
+    return -1
+
+def numba_available() -> bool:
+    # checked without importing numba, which is only loaded once its backend is picked
+    return importlib.util.find_spec("numba") is not None
+
+@lru_cache(maxsize=None)
+def _numba_kernels():
+    # compiled once per process and shared by all models
+    numba = importlib.import_module("numba")
+    return (
+        numba.njit(cache=True)(_classify_neighbors_loop),
+        numba.njit(cache=True)(_pick_destination_loop)
+    )
+
+class Kernels:
+    backend: str
+
+    def __init__(self, backend="auto") -> None:
+        if backend == "auto":
+            backend = os.environ.get("KIN_KERNELS", "numba" if numba_available() else "numpy")
+        if backend == "numba" and not numba_available():
+            raise ImportError("The numba kernel backend needs numba to be installed")
+        if backend not in ("numba", "numpy"):
+            raise ValueError("Unknown kernel backend '{}', expected 'auto', 'numba' or 'numpy'".format(backend))
+        self.backend = backend
+        # next_action only compares a few scalars per critter, calling it through numba costs more than it saves
+        self.next_action = _next_action
+        if backend == "numba":
+            (self.classify_neighbors, self.pick_destination) = _numba_kernels()
+        else:
+            self.classify_neighbors = _classify_neighbors_numpy
+            self.pick_destination = _pick_destination_numpy
+
+    def select_route(self, habitat_row, biom_grid, x, y, offsets, move_speed, u_choice, u_angle) -> tuple[float, float]:
+        # heads for a random suitable cell within reach, or in a random direction if there is none
+        i = self.pick_destination(habitat_row, biom_grid, x, y, offsets, u_choice)
+        if i < 0:
+            d = u_angle * 2*math.pi
+            return (move_speed*math.sin(d), move_speed*math.cos(d))
+        (dx, dy) = (int(offsets[i, 0]), int(offsets[i, 1]))
+        dist = math.sqrt(dx**2 + dy**2)
+        return ((dx / dist) * move_speed, (dy / dist) * move_speed)
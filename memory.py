@@ -0,0 +1,159 @@
+import csv
+import os
+import sys
+import warnings
+from functools import partial
+
+# rough C-side cost per entry that sys.getsizeof cannot see: a GEOS point, an rtree leaf entry
+GEOS_POINT_BYTES = 100
+RTREE_ENTRY_BYTES = 120
+SAMPLE_SIZE = 100
+
+SUBSYSTEMS = ("raster", "critters_alive", "critters_dead", "spatial_index", "neighborhood_cache", "collected_data")
+
+def object_size(obj) -> int:
+    # the object, its attribute dict and the numbers it owns, shared objects like enums or the model are left out
+    size = sys.getsizeof(obj) + sys.getsizeof(obj.__dict__)
+    for value in obj.__dict__.values():
+        if isinstance(value, (float, int)) and not isinstance(value, bool):
+            size += sys.getsizeof(value)
+    return size
+
+def sampled_size(objects: list, size_func=object_size) -> int:
+    if not len(objects):
+        return 0
+    step = max(len(objects) // SAMPLE_SIZE, 1)
+    sample = objects[::step]
+    return int(sum(size_func(obj) for obj in sample) / len(sample) * len(objects))
+
+def critter_size(critter) -> int:
+    return object_size(critter) + sys.getsizeof(critter.geometry) + GEOS_POINT_BYTES
+
+def memory_reporter(model, subsystem: str) -> float:
+    return model.memory.last_report.get(subsystem, 0) / 2**20
+
+def step_reporter(model) -> int:
+    return model.schedule.steps
+
+class MemoryMonitor:
+    budgets: dict[str, int]
+    every: int
+    spill_path: str | None
+    last_report: dict[str, int]
+
+    def __init__(self, model, budgets=None, every=10, spill_path=None) -> None:
+        # budgets map a subsystem (or "total") to the number of bytes it may hold before being compacted
+        unknown = [name for name in (budgets or {}) if name not in SUBSYSTEMS and name != "total"]
+        if len(unknown):
+            raise ValueError("Unknown memory budgets {}, expected some of {} or 'total'".format(unknown, SUBSYSTEMS))
+        self.model = model
+        self.budgets = dict(budgets or {})
+        self.every = every
+        self.spill_path = spill_path
+        self._cells = list(model.space.raster_layer)
+        self._raster_bytes = None
+        self.last_report = {}
+        self.spilled_rows = 0
+        # the charts show real numbers from the first collected row on, not zeros until the first check
+        self.report()
+
+    def report(self) -> dict[str, int]:
+        space = self.model.space
+        agents = space.agents
+        alive = [critter for critter in agents if critter.is_alive]
+        dead = [critter for critter in agents if not critter.is_alive]
+        report = {
+            "raster": self._raster_size(),
+            "critters_alive": sampled_size(alive, critter_size),
+            "critters_dead": sampled_size(dead, critter_size),
+            "spatial_index": sys.getsizeof(space._agent_layer.idx.agents) + len(agents) * RTREE_ENTRY_BYTES,
+            "neighborhood_cache": self._neighborhood_cache_size(),
+            "collected_data": self._collected_data_size()
+        }
+        report["total"] = sum(report.values())
+        self.last_report = report
+        return report
+
+    def reporters(self) -> dict:
+        return {
+            # the step each row was collected at, which labels the rows spill writes out
+            "Step": step_reporter,
+            **{
+                "Memory {} (MB)".format(subsystem): partial(memory_reporter, subsystem=subsystem)
+                for subsystem in (*SUBSYSTEMS, "total")
+            }
+        }
+
+    def step(self):
+        if self.every <= 0 or self.model.schedule.steps % self.every:
+            return
+        self.report()
+        self.enforce()
+
+    def enforce(self) -> list[str]:
+        report = self.last_report or self.report()
+        over = [name for name, budget in self.budgets.items() if report.get(name, 0) > budget]
+        actions = []
+        if any(name in over for name in ("critters_dead", "critters_alive", "spatial_index", "total")):
+            actions.append("removed {} dead critters".format(self.model.spawner.compact()))
+        if any(name in over for name in ("neighborhood_cache", "spatial_index", "total")):
+            self.model.space.raster_layer._neighborhood_cache.clear()
+            actions.append("cleared the neighborhood cache")
+        if any(name in over for name in ("collected_data", "total")):
+            if self.spill_path is not None:
+                actions.append("spilled {} rows to {}".format(self.spill(), self.spill_path))
+            else:
+                warnings.warn("Collected data is over its memory budget but no spill_path is set")
+        if "raster" in over:
+            warnings.warn("The raster layer is over its memory budget, it cannot be compacted")
+        if len(actions):
+            self.report()
+        return actions
+
+    def spill(self) -> int:
+        # appends all but the latest collected row to a csv file, the charts only ever read the latest one
+        model_vars = self.model.datacollector.model_vars
+        columns = ["Step", *(column for column in model_vars if column != "Step")]
+        n = min((len(values) for values in model_vars.values()), default=0) - 1
+        if n <= 0:
+            return 0
+        write_header = not os.path.exists(self.spill_path) or os.path.getsize(self.spill_path) == 0
+        with open(self.spill_path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(columns)
+            for i in range(n):
+                writer.writerow([model_vars[column][i] for column in columns])
+        for column in columns:
+            del model_vars[column][:n]
+        self.spilled_rows += n
+        return n
+
+    def _raster_size(self) -> int:
+        # the cells only ever change their values, not their layout, so they are measured once,
+        # the terrain arrays are shared between models and not counted here
+        if self._raster_bytes is None:
+            layer = self.model.space.raster_layer
+            self._raster_bytes = (
+                sampled_size(self._cells)
+                + sum(sys.getsizeof(column) for column in layer.cells)
+                + self.model.space.biom_grid.nbytes
+            )
+        return self._raster_bytes
+
+    def _neighborhood_cache_size(self) -> int:
+        cache = self.model.space.raster_layer._neighborhood_cache
+        size = sys.getsizeof(cache)
+        for neighborhood in cache.values():
+            # a list of (x, y) tuples of small ints
+            size += sys.getsizeof(neighborhood) + len(neighborhood) * sys.getsizeof((0, 0))
+        return size
+
+    def _collected_data_size(self) -> int:
+        datacollector = getattr(self.model, "datacollector", None)
+        if datacollector is None:
+            return 0
+        size = 0
+        for values in datacollector.model_vars.values():
+            size += sys.getsizeof(values) + len(values) * sys.getsizeof(0.0)
+        return size
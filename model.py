@@ -1,11 +1,18 @@
-import random
-import uuid
+from functools import partial
 from mesa import Model
 from mesa.time import RandomActivation
-from space import World
-from shapely.geometry import Point
-from agent import Critter, Species, critter_init_values, get_happiness_function
+from space import World, BiomType
+from movement import MovementStage
+from spawning import Spawner
+from agent import Critter, Species, critter_init_values
+from config import SpeciesTables
+from regions import RegionIndex
+from kernels import Kernels
+from memory import MemoryMonitor
+from urban import UrbanGrowth
+import os
 import math
+import numpy as np
 
 class KinMaking(Model):
     height: int
@@ -15,6 +22,7 @@ class KinMaking(Model):
     sealevel_rise_rate: float
     human_expansion_rate: float
     mod_pollution: float
+    init_mod_pollution: float
     sea_level: float
     init_sea_level: float
     init_global_temperature: float
@@ -23,6 +31,14 @@ class KinMaking(Model):
     temp_rise_exp: float
     crs: str
     init_num_critters: int
+    movement: MovementStage
+    spawner: Spawner
+    tables: SpeciesTables
+    regions: RegionIndex
+    rng: np.random.Generator
+    kernels: Kernels
+    memory: MemoryMonitor
+    urban: UrbanGrowth
     population_reporters: dict
     population_charts: dict
 
@@ -44,7 +60,15 @@ class KinMaking(Model):
         height_map_url="./data/jakarta_heightmap_2.png",
         seg_map_url="./data/jakarta_fake_2.png",
         min_h=-50,
-        max_h=600
+        max_h=600,
+        boundary_policy="reflect",
+        district_maps=None,
+        spin_up_steps=0,
+        kernel_backend="auto",
+        memory_budgets=None,
+        memory_check_every=10,
+        spill_path=None,
+        seed=None
     ) -> None:
         super().__init__()
         self.crs = "epsg:3857"
@@ -54,6 +78,7 @@ class KinMaking(Model):
         self.sealing_rate = sealing_rate
         self.sealevel_rise_rate = sealevel_rise_rate
         self.human_expansion_rate = human_expansion_rate
+        self.init_mod_pollution = init_mod_pollution
         self.mod_pollution = init_mod_pollution
         self.init_sea_level = init_sea_level
         self.sea_level = init_sea_level
@@ -66,10 +91,19 @@ class KinMaking(Model):
         self.seg_map_url = seg_map_url
         (self.min_h, self.max_h)=(min_h, max_h)
         
+        self.tables = SpeciesTables(critter_init_values, list(BiomType))
+        self.kernels = Kernels(kernel_backend)
+        self.rng = np.random.default_rng(self.random.getrandbits(64))
         self.schedule = RandomActivation(self)
         self._init_world(data_path)
+        self.urban = UrbanGrowth(self)
+        self.advance_environment(spin_up_steps)
+        self.movement = MovementStage(self.width, self.height, policy=boundary_policy)
+        self.spawner = Spawner(self)
         self._init_populations()
         self._init_critters(init_num_critters)
+        self._init_regions(district_maps)
+        self.memory = MemoryMonitor(self, budgets=memory_budgets, every=memory_check_every, spill_path=spill_path)
         self.initialize_data_collector(
                 model_reporters={
                     "Overall Air Pollution": "pct_air_polluted",
@@ -82,7 +116,10 @@ class KinMaking(Model):
                     "Dead Critters": "dead_critters",
                     "Alive Critters": "alive_critters",
                     "New Critters": "new_critters",
-                    **self.population_reporters
+                    **self.urban.reporters(),
+                    **self.population_reporters,
+                    **self.regions.reporters(),
+                    **self.memory.reporters()
                 }
         )
 
@@ -96,7 +133,7 @@ class KinMaking(Model):
 
     @property
     def dead_critters(self) -> int:
-        return len([critter for critter in self.space.agents if not critter.is_alive])
+        return self.spawner.deaths
 
     @property
     def alive_critters(self) -> int:
@@ -104,7 +141,7 @@ class KinMaking(Model):
 
     @property
     def new_critters(self) -> int:
-        return len([critter for critter in self.space.agents if critter.is_offspring])
+        return self.spawner.births
 
     @property
     def pct_ground_polluted(self) -> float:
@@ -133,33 +170,44 @@ class KinMaking(Model):
         return self.global_temperature + avg_d_temp
 
     def step(self):
-        self.global_temperature += self.temp_rise_rate * (self.temp_rise_rate**self.schedule.time) + 2*math.sin(0.25*math.pi*self.schedule.time)
-        self.sea_level += self.sealevel_rise_rate
+        self._advance_globals()
         self.schedule.step()
+        self.urban.step()
+        self.movement.apply(self.space)
+        self.spawner.flush_births()
+        self.space.flush_type_changes()
+        self.memory.step()
         self.datacollector.collect(self)
 
-    def spawnCritter(self, species: Critter):
-            if not len(critter_init_values[species]["biom_cells"]):
-                return
-            cell = random.choice(critter_init_values[species]["biom_cells"])
-            (x,y) = (cell[1] - (self.width / 2), cell[2] - (self.height / 2))
-            geometry = Point(x,y)
-            critter = Critter(
-                unique_id=uuid.uuid4().int,
-                model=self,
-                crs=self.crs,
-                geometry=geometry,
-                species=species,
-                happinessFunction=get_happiness_function(species)
-            )
-            setattr(self, critter.species.value, getattr(self, critter.species.value) + 1)
-            setattr(self, "init_{}".format(critter.species.value), getattr(self, critter.species.value) + 1)
-            self.space.add_agents(critter)
-            self.schedule.add(critter)
+    def _advance_globals(self, time=None):
+        time = self.schedule.time if time is None else time
+        self.global_temperature += self.temp_rise_rate * (self.temp_rise_rate**time) + 2*math.sin(0.25*math.pi*time)
+        self.sea_level += self.sealevel_rise_rate
+
+    def advance_environment(self, n: int):
+        # fast-forwards temperature, sea level and all cells by n steps without stepping the critters
+        if n <= 0:
+            return
+        sea_levels = []
+        for i in range(n):
+            self._advance_globals(self.schedule.time + i)
+            sea_levels.append(self.sea_level)
+        self.space.advance_cells(self, sea_levels, self.rng)
+        # the city catches up after the water, frontier cells that flooded in between are skipped
+        for _ in range(n):
+            self.urban.step()
+        self.space.flush_type_changes()
+        self.schedule.time += n
+        self.schedule.steps += n
+
+    def spawnCritter(self, species: Species):
+        return self.spawner.spawn_many(species, 1)
 
     def killCritter(self, critter: Critter):
-        setattr(self, critter.species.value, getattr(self, critter.species.value) - 1)
-        self.schedule.remove(critter)
+        self.spawner.remove(critter)
+
+    def population_of(self, species: Species) -> int:
+        return int(self.spawner.population[self.spawner.species_index[species]])
 
     def _init_world(self, data_path):
         self.space = World(
@@ -176,24 +224,27 @@ class KinMaking(Model):
         for cell in self.space.raster_layer:
             self.schedule.add(cell)
 
+    def _init_regions(self, district_maps):
+        self.regions = RegionIndex(self)
+        # biom_grid holds BiomType values, bioms.json may list them in any order
+        self.regions.add_layer(
+            "biom", self.space.biom_grid, [biom_type.name for biom_type in sorted(BiomType, key=lambda b: b.value)]
+        )
+        for url in district_maps or []:
+            (name, ext) = os.path.splitext(os.path.basename(url))
+            if ext in (".json", ".geojson"):
+                self.regions.add_polygon_file(name, url)
+            else:
+                self.regions.add_mask_file(name, url)
+
     def _init_critters(self, num_critters: int):
-        n = num_critters
-        for species in list(Species):
-            critter_init_values[species]["biom_cells"] = list(filter(
-                lambda cell: cell[0].type in critter_init_values[species]["bioms"],
-                self.space.raster_layer.coord_iter()
-            ))
-        for _ in range(num_critters):
-            species = random.choice(list(Species))
-            self.spawnCritter(species)
+        self.spawner.spawn_initial(num_critters)
 
     def _init_populations(self):
         population_reporters = {}
         population_charts = []
         for species in list(Species):
-            setattr(self, species.value, 0)
-            setattr(self, "init_{}".format(species.value), 0)
-            population_reporters["{} population".format(species.value)] = species.value
+            population_reporters["{} population".format(species.value)] = partial(KinMaking.population_of, species=species)
             population_charts.append(
                 {"Label": "{} population".format(species.value), "Color": "Green"}
             )
@@ -0,0 +1,70 @@
+from enum import Enum
+import numpy as np
+from shapely.geometry import Point
+
+class BoundaryPolicy(Enum):
+    REFLECT = "reflect"
+    CLAMP = "clamp"
+    WRAP = "wrap"
+
+class MovementStage:
+    width: int
+    height: int
+    policy: BoundaryPolicy
+    _queue: list
+
+    def __init__(self, width, height, policy=BoundaryPolicy.REFLECT) -> None:
+        self.width = width
+        self.height = height
+        self.policy = BoundaryPolicy(policy)
+        self._queue = []
+
+    def queue(self, critter, dx: float, dy: float, is_route: bool = False):
+        self._queue.append((critter, dx, dy, is_route))
+
+    def apply(self, space):
+        if not len(self._queue):
+            return
+        critters = [entry[0] for entry in self._queue]
+        x = np.fromiter((critter.geometry.x for critter in critters), dtype=float, count=len(critters))
+        y = np.fromiter((critter.geometry.y for critter in critters), dtype=float, count=len(critters))
+        dx = np.array([entry[1] for entry in self._queue], dtype=float)
+        dy = np.array([entry[2] for entry in self._queue], dtype=float)
+        is_route = np.array([entry[3] for entry in self._queue], dtype=bool)
+        self._queue = []
+
+        (x, dx, hit_x) = self._bound(x + dx, dx, -self.width / 2, self.width / 2)
+        (y, dy, hit_y) = self._bound(y + dy, dy, -self.height / 2, self.height / 2)
+        (col, row) = self.snap(x, y)
+
+        # routes that hit the border are either bounced off or dropped so that a new one gets picked
+        hit = (hit_x | hit_y) & is_route
+        if self.policy == BoundaryPolicy.CLAMP:
+            dx[hit] = 0
+            dy[hit] = 0
+
+        for i, critter in enumerate(critters):
+            critter.geometry = Point(x[i], y[i])
+            critter._grid_pos = (int(col[i]), int(row[i]))
+            if hit[i]:
+                (critter.dx, critter.dy) = (float(dx[i]), float(dy[i]))
+        space.update_agent_index()
+
+    def snap(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        col = np.floor(x + self.width / 2).astype(np.int64)
+        row = np.floor(y + self.height / 2).astype(np.int64)
+        return (np.clip(col, 0, self.width - 1), np.clip(row, 0, self.height - 1))
+
+    def _bound(self, pos: np.ndarray, d: np.ndarray, lo: float, hi: float):
+        hit = (pos < lo) | (pos >= hi)
+        if not hit.any():
+            return (pos, d, hit)
+        if self.policy == BoundaryPolicy.WRAP:
+            pos = lo + np.mod(pos - lo, hi - lo)
+        elif self.policy == BoundaryPolicy.REFLECT:
+            pos = np.where(pos < lo, 2 * lo - pos, pos)
+            pos = np.where(pos >= hi, 2 * hi - pos, pos)
+            d = np.where(hit, -d, d)
+        # clamping also catches moves that are longer than the map itself after reflecting
+        pos = np.clip(pos, lo, np.nextafter(hi, lo))
+        return (pos, d, hit)
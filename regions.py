@@ -0,0 +1,159 @@
+import json
+from functools import partial
+import numpy as np
+from PIL import Image
+
+# per-cell fields gathered once per tick, in the order they are stored in RegionIndex._fields
+CELL_FIELDS = ("air_pollution", "ground_pollution", "sealing", "flooded", "d_temp")
+
+REGION_STATS = {
+    "Air Pollution": "air_pollution",
+    "Ground Pollution": "ground_pollution",
+    "Percent Flooded": "flooded",
+    "Percent Sealed Ground": "sealing",
+    "Average Temperature": "d_temp",
+    "Critters": "critters"
+}
+
+def polygon_mask(coords: list, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    # even-odd ray casting of all points against one polygon ring
+    inside = np.zeros(xs.shape, dtype=bool)
+    ring = np.asarray(coords, dtype=float)
+    for (x1, y1), (x2, y2) in zip(ring, np.roll(ring, -1, axis=0)):
+        if y1 == y2:
+            continue
+        crosses = (y1 > ys) != (y2 > ys)
+        x_cross = x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (xs < x_cross)
+    return inside
+
+class RegionIndex:
+    layers: dict[str, np.ndarray]
+    labels: dict[str, list[str]]
+
+    def __init__(self, model) -> None:
+        self.model = model
+        self.layers = {}
+        self.labels = {}
+        self._cells = list(model.space.raster_layer)
+        self._fields = None
+        self._fields_step = None
+        self._stats = {}
+        self._stats_step = None
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.model.space.biom_grid.shape
+
+    def add_layer(self, name: str, label_grid: np.ndarray, label_names: list[str]):
+        # label_grid holds, for each (x, y) cell, the index into label_names or -1 for no region
+        if label_grid.shape != self.shape:
+            raise ValueError("Region layer '{}' has shape {}, expected {}".format(name, label_grid.shape, self.shape))
+        self.layers[name] = label_grid
+        self.labels[name] = list(label_names)
+        self._stats_step = None
+
+    def add_mask_file(self, name: str, url: str, names: dict | None = None):
+        # every distinct non-black color of the mask is one region, oriented like the segmentation map
+        img = np.array(Image.open(url).convert("RGB").rotate(270))
+        colors, label_grid = np.unique(img.reshape(-1, 3), axis=0, return_inverse=True)
+        label_grid = label_grid.reshape(img.shape[:2]).astype(np.int32)
+        keep = [i for i, color in enumerate(colors) if color.any()]
+        remap = np.full(len(colors), -1, dtype=np.int32)
+        remap[keep] = np.arange(len(keep))
+        label_names = []
+        for i in keep:
+            color = "#{:02x}{:02x}{:02x}".format(*colors[i])
+            label_names.append(names.get(color, color) if names is not None else color)
+        self.add_layer(name, remap[label_grid], label_names)
+
+    def add_polygon_file(self, name: str, url: str, name_property: str = "name"):
+        # GeoJSON polygons in the model's coordinates, a cell belongs to a polygon if its center does
+        with open(url) as f:
+            features = json.load(f)["features"]
+        (width, height) = self.shape
+        (xs, ys) = np.meshgrid(
+            np.arange(width) - (width / 2) + 0.5, np.arange(height) - (height / 2) + 0.5, indexing="ij"
+        )
+        label_grid = np.full(self.shape, -1, dtype=np.int32)
+        label_names = []
+        for feature in features:
+            geometry = feature["geometry"]
+            polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+            mask = np.zeros(self.shape, dtype=bool)
+            for rings in polygons:
+                mask |= polygon_mask(rings[0], xs, ys)
+                for hole in rings[1:]:
+                    mask &= ~polygon_mask(hole, xs, ys)
+            label_grid[mask] = len(label_names)
+            label_names.append(str(feature.get("properties", {}).get(name_property, len(label_names))))
+        self.add_layer(name, label_grid, label_names)
+
+    def cell_fields(self) -> np.ndarray:
+        # one pass over all cells, shaped (fields, width, height) to line up with the label grids
+        if self._fields_step != self.model.schedule.steps:
+            data = np.array(
+                [(cell.air_pollution, cell.ground_pollution, cell.sealing, cell.flooded, cell.d_temp) for cell in self._cells],
+                dtype=float
+            )
+            self._fields = data.T.reshape(len(CELL_FIELDS), *self.shape)
+            self._fields_step = self.model.schedule.steps
+        return self._fields
+
+    def region_sums(self, layer: str, field: str) -> np.ndarray:
+        return self._bincount(layer, self.cell_fields()[CELL_FIELDS.index(field)])
+
+    def region_means(self, layer: str, field: str) -> np.ndarray:
+        sizes = self.region_sizes(layer)
+        return self.region_sums(layer, field) / np.maximum(sizes, 1)
+
+    def region_sizes(self, layer: str) -> np.ndarray:
+        return self._bincount(layer)
+
+    def critter_counts(self, layer: str, species=None) -> np.ndarray:
+        positions = [
+            critter.grid_pos for critter in self.model.space.agents
+            if critter.is_alive and (species is None or critter.species == species)
+        ]
+        n = len(self.labels[layer])
+        if not len(positions):
+            return np.zeros(n, dtype=np.int64)
+        (x, y) = np.array(positions).T
+        labels = self.layers[layer][x, y]
+        return np.bincount(labels[labels >= 0], minlength=n)
+
+    def stats(self, layer: str) -> dict[str, dict[str, float]]:
+        if self._stats_step != self.model.schedule.steps:
+            self._stats = {}
+            self._stats_step = self.model.schedule.steps
+        if layer not in self._stats:
+            columns = {stat: self._stat_column(layer, stat) for stat in REGION_STATS}
+            self._stats[layer] = {
+                label: {stat: float(column[i]) for stat, column in columns.items()}
+                for i, label in enumerate(self.labels[layer])
+            }
+        return self._stats[layer]
+
+    def reporters(self) -> dict:
+        return {
+            "{} {} {}".format(layer, label, stat): partial(region_reporter, layer=layer, label=label, stat=stat)
+            for layer in self.layers for label in self.labels[layer] for stat in REGION_STATS
+        }
+
+    def _stat_column(self, layer: str, stat: str) -> np.ndarray:
+        field = REGION_STATS[stat]
+        if field == "critters":
+            return self.critter_counts(layer)
+        if field == "d_temp":
+            return self.model.global_temperature + self.region_means(layer, field)
+        return 100 * self.region_means(layer, field)
+
+    def _bincount(self, layer: str, weights: np.ndarray | None = None) -> np.ndarray:
+        # shift by one so that cells without a region land in bin 0, which is dropped
+        labels = self.layers[layer].ravel().astype(np.int64) + 1
+        return np.bincount(
+            labels, weights=None if weights is None else weights.ravel(), minlength=len(self.labels[layer]) + 1
+        )[1:]
+
+def region_reporter(model, layer: str, label: str, stat: str) -> float:
+    return model.regions.stats(layer)[label][stat]
@@ -1,11 +1,19 @@
+import os
+import weakref
+from functools import partial
 from random import random
 from mesa.visualization.ModularVisualization import ModularServer
 from mesa.visualization.modules import CanvasGrid, ChartModule, TextElement
-from mesa.visualization.UserParam import UserSettableParameter, Slider
+from mesa.visualization.UserParam import UserSettableParameter, Slider, Choice
 from model import Species
 from mesa_geo.visualization.modules import MapModule
-from space import BiomCell, biom_init_values
+from mesa_geo.raster_layers import ImageLayer
+from folium.utilities import image_to_url
+from PIL import ImageColor
+from shapely.geometry import mapping
+from space import BiomCell, BiomType, biom_init_values
 from model import KinMaking, Critter, critter_init_values
+from sessions import SharedTerrainServer, ZoomSocketHandler, use_socket_handler
 import numpy as np
 
 class GlobalTempText(TextElement):
@@ -64,6 +72,105 @@ def critter_portrayal(critter: Critter) -> dict:
             "radius": 1, "color": [150,150,150,0.8]
         }
 
+def bin_critters(model: KinMaking, bins: int) -> np.ndarray:
+    # living critters per species on a coarse (species, bins, bins) grid in a single bincount
+    critters = [critter for critter in model.space.agents if critter.is_alive]
+    n_species = len(model.tables.species)
+    if not len(critters):
+        return np.zeros((n_species, bins, bins), dtype=np.int64)
+    (x, y) = np.array([critter.grid_pos for critter in critters]).T
+    species = np.array([critter.species_idx for critter in critters])
+    bx = np.minimum(x * bins // model.width, bins - 1)
+    by = np.minimum(y * bins // model.height, bins - 1)
+    return np.bincount((species * bins + bx) * bins + by, minlength=n_species * bins * bins).reshape(n_species, bins, bins)
+
+def density_image(counts: np.ndarray, species: list) -> np.ndarray:
+    # each bin takes the color of its most common species, more critters make it more opaque
+    colors = np.array([ImageColor.getrgb(critter_init_values[s]["color"])[:3] for s in species], dtype=np.uint8)
+    total = counts.sum(axis=0)
+    rgb = colors[counts.argmax(axis=0)]
+    alpha = np.where(total > 0, 80 + 175 * total / max(total.max(), 1), 0).astype(np.uint8)
+    values = np.concatenate([rgb.transpose(2, 0, 1), alpha[np.newaxis]])
+    # (band, x, y) to image rows, top row being the highest y like RasterLayer.to_image
+    return values.transpose(0, 2, 1)[:, ::-1, :]
+
+def patch_image(values: np.ndarray, layer, colormap, change):
+    for (x, y) in zip(change.x.tolist(), change.y.tolist()):
+        cell = layer.cells[x][y]
+        (row, col) = cell.indices
+        values[:, row, col] = colormap(cell)
+
+# sends the browser's map zoom with its step requests, inlined because MapModule's local_dir is mesa_geo's
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "js", "critter_map.js")) as f:
+    ZOOM_HOOK_JS = f.read()
+
+class CritterMapModule(MapModule):
+    # above max_points living critters, or zoomed out below min_point_zoom, critters are drawn as a density overlay
+    def __init__(self, *args, max_points=5000, min_point_zoom=0, density_bins=64, zoom=None, **kwargs):
+        super().__init__(*args, zoom=zoom, **kwargs)
+        self.max_points = max_points
+        self.min_point_zoom = min_point_zoom
+        self.density_bins = density_bins
+        self.zoom = zoom
+        self.js_code = ZOOM_HOOK_JS + self.js_code
+        # the colored raster of every model rendered so far, patched from its cell type changes
+        self._images = weakref.WeakKeyDictionary()
+        # the zoom each model's browser last reported, see sessions.forward_zoom
+        self._zooms = weakref.WeakKeyDictionary()
+
+    def set_zoom(self, model: KinMaking, zoom: float):
+        self._zooms[model] = zoom
+
+    def use_density(self, model: KinMaking) -> bool:
+        zoom = self._zooms.get(model, self.zoom)
+        if zoom is not None and zoom < self.min_point_zoom:
+            return True
+        return int(model.spawner.population.sum()) > self.max_points
+
+    def render(self, model: KinMaking):
+        layers = self._render_layers(model)
+        if not self.use_density(model):
+            return {"layers": layers, "agents": self._render_agents(model)}
+        overlay = ImageLayer(
+            values=density_image(bin_critters(model, self.density_bins), model.tables.species),
+            crs=model.space.crs,
+            total_bounds=model.space.raster_layer.total_bounds
+        )
+        layers["rasters"].append(image_to_url(overlay.to_crs(self._crs).values.transpose([1, 2, 0])))
+        return {"layers": layers, "agents": {"type": "FeatureCollection", "features": []}}
+
+    def _render_layers(self, model: KinMaking):
+        layer = model.space.raster_layer
+        image = ImageLayer(values=self._raster_image(model), crs=layer.crs, total_bounds=layer.total_bounds)
+        (min_x, min_y, max_x, max_y) = model.space.total_bounds
+        (xx, yy) = model.space.transformer.transform(xx=[min_x, max_x], yy=[min_y, max_y])
+        return {
+            "rasters": [image_to_url(image.to_crs(self._crs).values.transpose([1, 2, 0]))],
+            "vectors": [],
+            "total_bounds": [[yy[0], xx[0]], [yy[1], xx[1]]]
+        }
+
+    def _raster_image(self, model: KinMaking) -> np.ndarray:
+        # colored in full once, after that only the cells that changed their type are recolored
+        if model not in self._images:
+            layer = model.space.raster_layer
+            self._images[model] = layer.to_image(colormap=self.portrayal_method).values
+            model.space.add_type_listener(partial(patch_image, self._images[model], layer, self.portrayal_method))
+        return self._images[model]
+
+    def _render_agents(self, model: KinMaking):
+        # dead critters stay in the space but are not worth sending to the browser
+        features = []
+        for critter in model.space.agents:
+            if not critter.is_alive:
+                continue
+            features.append({
+                "type": "Feature",
+                "geometry": mapping(critter.get_transformed_geometry(model.space.transformer)),
+                "properties": {"pointToLayer": self.portrayal_method(critter)}
+            })
+        return {"type": "FeatureCollection", "features": features}
+
 def draw(agent: BiomCell | Critter):
     if isinstance(agent, BiomCell):
         return cell_portrayal(agent)
@@ -84,14 +191,19 @@ model_params = {
     "human_expansion_rate": Slider("Human Expansion Rate", 1.05, 0.5, 1.5, 0.01),
     "temp_rise_rate": Slider("Global Temp Rise Rate", 0.1, 0.0, 1.0, 0.05),
     "temp_rise_exp": Slider("Global Temp Rise Exponent", 1.02, 1, 1.2, 0.01),
-    "init_num_critters": Slider("Number of critters", 100, 1, 1000, 1)
+    "init_num_critters": Slider("Number of critters", 100, 1, 1000, 1),
+    "spin_up_steps": Slider("Environment Spin-up Steps", 0, 0, 100, 1),
+    "boundary_policy": Choice("Map Border Behaviour", "reflect", ["reflect", "clamp", "wrap"])
 }
-map_module = MapModule(
+map_module = CritterMapModule(
     portrayal_method=draw,
     map_height=grid_size[1],
     map_width=grid_size[0],
     view=[0, 0],
     zoom=17.2,
+    max_points=5000,
+    min_point_zoom=16,
+    density_bins=64
 )
 
 temp_text = GlobalTempText()
@@ -107,13 +219,37 @@ chart_temp = ChartModule([
     {"Label": "Average Temperature", "Color": "Pink"},
 ])
 
+chart_biom_temp = ChartModule(
+    [{"Label": "biom {} Average Temperature".format(biom_type.name), "Color": "rgb{}".format(biom_init_values[biom_type]["color"])} for biom_type in list(BiomType)]
+)
+
+chart_urban = ChartModule([
+    {"Label": "Percent Built-up", "Color": "Gray"},
+])
+
 chart_population = ChartModule(
     [{"Label": "{} population".format(species.value), "Color": critter_init_values[species]["color"]} for species in list(Species)]
 )
 
-server = ModularServer(
-    KinMaking,
-    [map_module, temp_text, pop_text, chart_poll, chart_temp, chart_population],
-    "Making Kin with Python",
-    model_params,
-)
+visualization_elements = [map_module, temp_text, pop_text, chart_poll, chart_temp, chart_biom_temp, chart_urban, chart_population]
+
+# KIN_MAX_SESSIONS > 0 gives every browser its own model on a shared terrain, otherwise all browsers share one model
+max_sessions = int(os.environ.get("KIN_MAX_SESSIONS", 0))
+if max_sessions > 0:
+    server = SharedTerrainServer(
+        KinMaking,
+        visualization_elements,
+        "Making Kin with Python",
+        model_params,
+        max_sessions=max_sessions,
+        idle_timeout=float(os.environ.get("KIN_IDLE_TIMEOUT", 900)),
+        workers=int(os.environ.get("KIN_WORKERS", 4))
+    )
+else:
+    server = ModularServer(
+        KinMaking,
+        visualization_elements,
+        "Making Kin with Python",
+        model_params,
+    )
+    use_socket_handler(server, ZoomSocketHandler)
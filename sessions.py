@@ -0,0 +1,209 @@
+import asyncio
+import copy
+import inspect
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import tornado.escape
+import tornado.ioloop
+from mesa.visualization.ModularVisualization import ModularServer, SocketHandler, is_user_param
+from space import load_terrain
+
+# websocket close code sent to a browser whose session was dropped or could not be opened
+SESSION_CLOSED = 4000
+
+def model_params(model_kwargs: dict) -> dict:
+    # the values of the user settable parameters, like ModularServer.reset_model passes them on
+    params = {}
+    for key, val in model_kwargs.items():
+        if is_user_param(val):
+            if val.param_type == "static_text":
+                continue
+            params[key] = val.value
+        else:
+            params[key] = val
+    return params
+
+def warm_terrain(model_cls, params: dict):
+    # loads the terrain a model with these parameters would use, so the first session does not wait for it
+    args = inspect.signature(model_cls).bind(**params)
+    args.apply_defaults()
+    load_terrain(args.arguments["height_map_url"], args.arguments["seg_map_url"], args.arguments["min_h"], args.arguments["max_h"])
+
+def forward_zoom(application, model, msg: dict):
+    # the map zoom the browser sends with its requests, see static/js/critter_map.js
+    if model is None or msg.get("zoom") is None:
+        return
+    for element in application.visualization_elements:
+        if hasattr(element, "set_zoom"):
+            element.set_zoom(model, float(msg["zoom"]))
+
+def use_socket_handler(application, handler_cls):
+    # swaps the handler ModularServer registered for "/ws"
+    for rule in application.wildcard_router.rules:
+        if rule.target is SocketHandler:
+            rule.target = handler_cls
+
+class Session:
+    id: str
+    model_kwargs: dict
+    last_seen: float
+
+    def __init__(self, handler, model_kwargs: dict) -> None:
+        self.id = uuid.uuid4().hex
+        self.handler = handler
+        # every browser moves its own sliders
+        self.model_kwargs = copy.deepcopy(model_kwargs)
+        self.model = None
+        self.lock = asyncio.Lock()
+        self.last_seen = time.monotonic()
+
+    @property
+    def idle_for(self) -> float:
+        return time.monotonic() - self.last_seen
+
+class SessionManager:
+    max_sessions: int
+    idle_timeout: float
+    sessions: dict[str, Session]
+
+    def __init__(self, application, max_sessions=30, idle_timeout=900, workers=4) -> None:
+        self.application = application
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="session")
+
+    def open(self, handler) -> Session | None:
+        if len(self.sessions) >= self.max_sessions:
+            self.evict_idle()
+        if len(self.sessions) >= self.max_sessions:
+            return None
+        session = Session(handler, self.application.model_kwargs)
+        self.sessions[session.id] = session
+        return session
+
+    def close(self, session: Session):
+        # the model is dropped with the session, the terrain it used stays loaded for the others
+        self.sessions.pop(session.id, None)
+        session.model = None
+
+    def evict_idle(self) -> int:
+        idle = [
+            session for session in self.sessions.values()
+            if session.idle_for > self.idle_timeout and not session.lock.locked()
+        ]
+        for session in idle:
+            self.close(session)
+            session.handler.close(SESSION_CLOSED, "Session closed after {} idle seconds".format(int(self.idle_timeout)))
+        return len(idle)
+
+    async def run(self, session: Session, func, *args):
+        # one call at a time per session, the pool runs different sessions side by side
+        session.last_seen = time.monotonic()
+        async with session.lock:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        session.last_seen = time.monotonic()
+        return result
+
+    def reset(self, session: Session, msg=None):
+        session.model = self.application.model_cls(**model_params(session.model_kwargs))
+        session.model.running = True
+        forward_zoom(self.application, session.model, msg or {})
+        return self.application.render(session.model)
+
+    def step(self, session: Session, msg=None):
+        if session.model is None:
+            return self.reset(session, msg)
+        if not session.model.running:
+            return None
+        session.model.step()
+        forward_zoom(self.application, session.model, msg or {})
+        return self.application.render(session.model)
+
+class ZoomSocketHandler(SocketHandler):
+    # SocketHandler for a plain ModularServer that passes the browser's map zoom on to the map module
+    def on_message(self, message):
+        msg = tornado.escape.json_decode(message)
+        if msg["type"] == "get_step":
+            forward_zoom(self.application, self.application.model, msg)
+        elif msg["type"] == "reset":
+            self.application.reset_model()
+            forward_zoom(self.application, self.application.model, msg)
+            self.write_message(self.viz_state_message)
+            return
+        super().on_message(message)
+
+class SessionSocketHandler(SocketHandler):
+    # SocketHandler for a SharedTerrainServer, every connection steps a model of its own
+    def open(self):
+        self.session = self.application.sessions.open(self)
+        if self.session is None:
+            self.close(SESSION_CLOSED, "The server is full, try again later")
+            return
+        if self.application.verbose:
+            print("Session {} opened, {} running".format(self.session.id, len(self.application.sessions.sessions)))
+        self.write_message({"type": "model_params", "params": self.user_params})
+
+    def on_close(self):
+        if getattr(self, "session", None) is not None:
+            self.application.sessions.close(self.session)
+
+    @property
+    def user_params(self) -> dict:
+        return {param: val.json for param, val in self.session.model_kwargs.items() if is_user_param(val)}
+
+    async def on_message(self, message):
+        if self.session is None:
+            return
+        sessions = self.application.sessions
+        msg = tornado.escape.json_decode(message)
+
+        if msg["type"] == "get_step":
+            state = await sessions.run(self.session, sessions.step, self.session, msg)
+            self._send({"type": "end"} if state is None else {"type": "viz_state", "data": state})
+
+        elif msg["type"] == "reset":
+            state = await sessions.run(self.session, sessions.reset, self.session, msg)
+            self._send({"type": "viz_state", "data": state})
+
+        elif msg["type"] == "submit_params":
+            self.session.last_seen = time.monotonic()
+            (param, value) = (msg["param"], msg["value"])
+            if param in self.user_params:
+                if is_user_param(self.session.model_kwargs[param]):
+                    self.session.model_kwargs[param].value = value
+                else:
+                    self.session.model_kwargs[param] = value
+
+        elif self.application.verbose:
+            print("Unexpected message!")
+
+    def _send(self, message: dict):
+        # the socket may have closed while the worker was busy
+        if self.ws_connection is not None:
+            self.write_message(message)
+
+class SharedTerrainServer(ModularServer):
+    # a ModularServer for many browsers at once: each one gets its own model, stepped on a shared worker pool,
+    # while the terrain all of them are built from is loaded once per process and only ever read
+    def __init__(self, *args, max_sessions=30, idle_timeout=900, workers=4, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.sessions = SessionManager(self, max_sessions=max_sessions, idle_timeout=idle_timeout, workers=workers)
+        use_socket_handler(self, SessionSocketHandler)
+        self._evictor = None
+
+    def reset_model(self):
+        # there is no shared model, only the terrain the session models are built from
+        self.model = None
+        warm_terrain(self.model_cls, model_params(self.model_kwargs))
+
+    def render(self, model) -> list:
+        return [element.render(model) for element in self.visualization_elements]
+
+    def launch(self, port=None, open_browser=True):
+        # looks for idle sessions once a minute, or faster for short timeouts
+        interval = min(60, self.sessions.idle_timeout / 2)
+        self._evictor = tornado.ioloop.PeriodicCallback(self.sessions.evict_idle, interval * 1000)
+        self._evictor.start()
+        super().launch(port=port, open_browser=open_browser)
@@ -1,11 +1,15 @@
+from collections import OrderedDict
 from enum import Enum
+from functools import lru_cache
+import hashlib
 import math
-import random
+import threading
 from mesa_geo import Cell, RasterLayer
 from mesa_geo.geospace import GeoSpace
 from mesa import Model
 from shapely.geometry import Point
 import numpy as np
+import config
 from PIL import Image, ImageOps
 
 def simple_terrain (pos: tuple[float, float]) -> float:
@@ -13,105 +17,13 @@ def simple_terrain (pos: tuple[float, float]) -> float:
     y = pos[1]
     return 100*(math.atan(x-2)+(0.1*math.sin((2*x)+1))-(0.04*math.sin(((7*x)+1))) + 0.2*math.sqrt(y)+(0.02*math.sin(13*y)))
 
-class BiomType(Enum):
-    OCEAN = 0
-    COASTAL = 1
-    BEACH = 2
-    HARBOUR = 3
-    URBAN = 4
-    PARK = 5
-    INDUSTRIAL = 6
-    ROAD = 7
-    FOREST = 8
-    RIVER = 9
-    ROCK = 10
-    MEADOW = 11
+# biom definitions live in data/bioms.json, see config.py
+biom_config = config.load_bioms()
+BiomType = Enum("BiomType", {name: values["value"] for name, values in biom_config.items()})
 
 biom_init_values = {
-    BiomType.OCEAN: {
-        "air_pollution": 0.2,
-        "ground_pollution": 0.4,
-        "sealing": 0,
-        "d_temp": -5,
-        "color": (46,156,191)
-    },
-    BiomType.COASTAL: {
-        "air_pollution": 0.3,
-        "ground_pollution": 0.5,
-        "sealing": 0,
-        "d_temp": -3,
-        "color": (90,149,255)
-    },
-    BiomType.BEACH: {
-        "air_pollution": 0.3,
-        "ground_pollution": 0.4,
-        "sealing": 0,
-        "d_temp": 0,
-        "color": (255,229,135)
-    },
-    BiomType.HARBOUR: {
-        "air_pollution": 0.4,
-        "ground_pollution": 0.5,
-        "sealing": 0,
-        "d_temp": 1,
-        "color": (180,180,180)
-    },
-    BiomType.URBAN: {
-        "air_pollution": 0.5,
-        "ground_pollution": 0.5,
-        "sealing": 0.8,
-        "d_temp": 3,
-        "color": (200,200,200)
-    },
-    BiomType.PARK: {
-        "air_pollution": 0.3,
-        "ground_pollution": 0.3,
-        "sealing": 0.2,
-        "d_temp": -2,
-        "color": (168,219,102)
-    },
-    BiomType.INDUSTRIAL: {
-        "air_pollution": 0.6,
-        "ground_pollution": 0.6,
-        "sealing": 0.8,
-        "d_temp": 5,
-        "color": (179,145,106) 
-    },
-    BiomType.FOREST: {
-        "air_pollution": 0.1,
-        "ground_pollution": 0.2,
-        "sealing": 0.1,
-        "d_temp": -3,
-        "color": (40,156,82)
-    },
-    BiomType.ROAD: {
-        "air_pollution": 0.4,
-        "ground_pollution": 0.3,
-        "sealing": 1.0,
-        "d_temp": 1,
-        "color": (100,100,100) 
-    },
-    BiomType.RIVER: {
-        "air_pollution": 0.3,
-        "ground_pollution": 0.4,
-        "sealing": 0,
-        "d_temp": -1,
-        "color": (76,167,179)
-    },
-    BiomType.MEADOW: {
-        "air_pollution": 0.3,
-        "ground_pollution": 0.3,
-        "sealing": 0,
-        "d_temp": 0,
-        "color": (136,221,61)
-    },
-    BiomType.ROCK: {
-        "air_pollution": 0.2,
-        "ground_pollution": 0.2,
-        "sealing": 1,
-        "d_temp": 1,
-        "color": (140,140,140)
-    },
+    BiomType[name]: {key: value for key, value in values.items() if key != "value"}
+    for name, values in biom_config.items()
 }
 
 class BiomCell(Cell):
@@ -121,8 +33,6 @@ class BiomCell(Cell):
     ground_pollution: float | None
     sealing: float | None
     d_temp: float | None
-    altitude: float | None
-    alt_norm: float | None
     model: Model | None
     height_map: np.ndarray | None
     seg_map: np.ndarray | None
@@ -134,22 +44,31 @@ class BiomCell(Cell):
         indices=None
     ):
         super().__init__(pos, indices)
+        self.type = None
         self.flooded = False
-        self.altitude = 0
-        self.alt_norm = 0
+
+    # read from the terrain shared by every model on the map, instead of being copied into each cell
+    @property
+    def altitude(self) -> float:
+        terrain = self.model.space.terrain
+        return terrain.altitude_rows[self.pos[0]][self.pos[1]] if terrain is not None else 0
+
+    @property
+    def alt_norm(self) -> float:
+        terrain = self.model.space.terrain
+        return terrain.alt_norm_rows[self.pos[0]][self.pos[1]] if terrain is not None else 0
 
     def _get_flooded(self, init=False):
         if self.altitude <= self.model.sea_level:
             self.flooded = True
-            if self.model.sea_level - self.altitude > 20:
-                self.type = BiomType.OCEAN
-            else:
-                self.type = BiomType.COASTAL
+            biom_type = BiomType.OCEAN if self.model.sea_level - self.altitude > 20 else BiomType.COASTAL
+            if self.type != biom_type:
+                self.model.space.set_cell_type(self, biom_type)
 
     def step(self):
-        mod = random.gauss(0, 0.1)
-        self.air_pollution *= (self.model.pollution_rate + mod)
-        self.ground_pollution *= (self.model.pollution_rate + mod)
+        mod = self.model.random.gauss(0, 0.1)
+        self.air_pollution *= (self.model.pollution_rate + self.model.mod_pollution + mod)
+        self.ground_pollution *= (self.model.pollution_rate + self.model.mod_pollution + mod)
         self.sealing *= (self.model.sealing_rate + mod)
         self.d_temp *= (self.model.temp_rise_exp + mod)
         self._clamp_data()
@@ -169,7 +88,97 @@ class BiomCell(Cell):
 
 
     
+def classify_seg_map(seg_map: np.ndarray) -> np.ndarray:
+    # BiomType values for a whole segmentation map, matching colors as packed integers
+    seg_map = seg_map.astype(np.int64)
+    keys = (seg_map[..., 0] << 16) | (seg_map[..., 1] << 8) | seg_map[..., 2]
+    (colors, inverse) = np.unique(keys, return_inverse=True)
+    by_color = {
+        (r << 16) | (g << 8) | b: biom_type.value
+        for biom_type, (r, g, b) in ((biom_type, biom_init_values[biom_type]["color"]) for biom_type in BiomType)
+    }
+    values = np.array([by_color.get(int(color), BiomType.ROCK.value) for color in colors], dtype=np.int8)
+    return values[inverse.reshape(keys.shape)]
+
+# distinct (habitat, biom grid) pairs a terrain keeps the habitat cells of
+HABITAT_CACHE_SIZE = 8
+
+class Terrain:
+    # the immutable part of a map, loaded once per process and shared read-only by every model using it
+    height_map: np.ndarray
+    alt_norm_xy: np.ndarray
+    altitude_xy: np.ndarray
+    alt_norm_rows: list[list[float]]
+    altitude_rows: list[list[float]]
+    seg_map: np.ndarray
+    biom_grid: np.ndarray
+
+    def __init__(
+        self,
+        height_map_url="./data/jakarta_heightmap_2.png",
+        seg_map_url="./data/jakarta_fake_2.png",
+        min_h=-50,
+        max_h=600
+    ):
+        img_gs = np.array(ImageOps.grayscale(Image.open(height_map_url))) / 255
+        self.height_map = np.interp(img_gs, (0, 1), (min_h, max_h))
+        # image rows run from the top of the map down, cells are indexed (x, y) from the bottom up
+        self.alt_norm_xy = img_gs[::-1].T
+        self.altitude_xy = self.height_map[::-1].T
+        self.seg_map = np.array(Image.open(seg_map_url).convert("RGB").rotate(270))
+        self.biom_grid = classify_seg_map(self.seg_map)
+        for array in (self.height_map, self.alt_norm_xy, self.altitude_xy, self.seg_map, self.biom_grid):
+            array.flags.writeable = False
+        # the same values as nested lists, which BiomCell reads a single value from much faster than from an array
+        self.alt_norm_rows = self.alt_norm_xy.tolist()
+        self.altitude_rows = self.altitude_xy.tolist()
+        self._habitat_cells = OrderedDict()
+        # models are built on the session worker threads, see sessions.py
+        self._lock = threading.Lock()
+
+    def habitat_cells(self, habitat: np.ndarray, biom_grid: np.ndarray) -> list[np.ndarray]:
+        # (n, 2) x/y positions of the habitat of every species, models starting from the same biom grid share them
+        key = hashlib.sha1(habitat.tobytes() + biom_grid.tobytes()).digest()
+        with self._lock:
+            if key in self._habitat_cells:
+                self._habitat_cells.move_to_end(key)
+                return self._habitat_cells[key]
+            cells = [np.argwhere(row[biom_grid]).astype(np.int32) for row in habitat]
+            for array in cells:
+                array.flags.writeable = False
+            self._habitat_cells[key] = cells
+            if len(self._habitat_cells) > HABITAT_CACHE_SIZE:
+                self._habitat_cells.popitem(last=False)
+            return cells
+
+_terrain_lock = threading.Lock()
+
+@lru_cache(maxsize=8)
+def _load_terrain(height_map_url, seg_map_url, min_h, max_h) -> Terrain:
+    return Terrain(height_map_url, seg_map_url, min_h, max_h)
+
+def load_terrain(height_map_url, seg_map_url, min_h, max_h) -> Terrain:
+    # sessions starting at the same time wait for one load instead of each building their own Terrain
+    with _terrain_lock:
+        return _load_terrain(height_map_url, seg_map_url, min_h, max_h)
+
+class TypeChange:
+    # cells whose BiomType changed since the last flush, as (x, y) positions with the old and new type values
+    x: np.ndarray
+    y: np.ndarray
+    old: np.ndarray
+    new: np.ndarray
+
+    def __init__(self, x, y, old, new) -> None:
+        (self.x, self.y, self.old, self.new) = (x, y, old, new)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
 class World(GeoSpace):
+    biom_grid: np.ndarray
+    terrain: Terrain | None
+
     @property
     def raster_layer(self):
         return self.layers[0]
@@ -191,6 +200,11 @@ class World(GeoSpace):
                 cell_cls=BiomCell
             )
         )
+        # BiomType values of all cells, indexed by (x, y) like the raster layer
+        self.biom_grid = np.zeros((width, height), dtype=np.int8)
+        self.terrain = None
+        self._type_changes = []
+        self._type_listeners = []
 
     def load_map(self, path, model):
         return
@@ -198,52 +212,102 @@ class World(GeoSpace):
     def generate_map(self, model):
         cell: BiomCell
 
-        self._load_heightmap(url=model.height_map_url, min_h=model.min_h, max_h=model.max_h)
-        self._load_seg_map(url=model.seg_map_url)
+        self.terrain = load_terrain(model.height_map_url, model.seg_map_url, model.min_h, model.max_h)
+        (self.height_map, self.seg_map) = (self.terrain.height_map, self.terrain.seg_map)
+        self.raster_layer.attributes.update(("alt_norm", "altitude"))
+        biom_grid = self.terrain.biom_grid.tolist()
+        biom_types = {biom_type.value: biom_type for biom_type in BiomType}
         for cell in self.raster_layer:
-            cell.type = self._get_cell_biom_type(cell.pos)
+            (x, y) = cell.pos
             cell.model = model
+            self.set_cell_type(cell, biom_types[biom_grid[x][y]])
             cell.init_values()
             cell.step()
+        # what floods while the map is generated is part of the map, not a change to it
+        self._type_changes = []
 
-    def _load_heightmap(
-        self,
-        min_h=-50,
-        max_h=600,
-        url="./data/jakarta_heightmap_2.png"
-    ):
-        img_rgba = Image.open(url)
-        img_gs = np.array(ImageOps.grayscale(img_rgba)) / 255
-        self.height_map = np.interp(img_gs, (0, 1), (min_h, max_h))
-        self.raster_layer.apply_raster(np.array([img_gs]), attr_name="alt_norm")
-        self.raster_layer.apply_raster(np.array([self.height_map]), attr_name="altitude")
+    def advance_cells(self, model, sea_levels: list[float], rng: np.random.Generator):
+        # BiomCell.step for every cell and every sea level in one go, on arrays instead of cell objects
+        cells = list(self.raster_layer)
+        data = np.array(
+            [(cell.air_pollution, cell.ground_pollution, cell.sealing, cell.d_temp, cell.flooded) for cell in cells],
+            dtype=float
+        )
+        (air_pollution, ground_pollution, sealing, d_temp) = [np.ascontiguousarray(column) for column in data.T[:4]]
+        flooded = data[:, 4].astype(bool)
+        # the raster layer iterates x-major, like a raveled (x, y) array
+        altitude = self.terrain.altitude_xy.ravel()
+        types = self.biom_grid.ravel().copy()
+        for sea_level in sea_levels:
+            mod = rng.normal(0, 0.1, len(cells))
+            air_pollution *= model.pollution_rate + model.mod_pollution + mod
+            ground_pollution *= model.pollution_rate + model.mod_pollution + mod
+            sealing *= model.sealing_rate + mod
+            d_temp *= model.temp_rise_exp + mod
+            np.minimum(air_pollution, 1, out=air_pollution)
+            np.minimum(ground_pollution, 1, out=ground_pollution)
+            np.minimum(sealing, 1, out=sealing)
+            is_flooded = altitude <= sea_level
+            flooded |= is_flooded
+            types[is_flooded] = np.where(
+                sea_level - altitude[is_flooded] > 20, BiomType.OCEAN.value, BiomType.COASTAL.value
+            )
+        changed = np.flatnonzero(types != self.biom_grid.ravel())
+        for (cell, air, ground, seal, temp, is_flooded) in zip(
+            cells, air_pollution.tolist(), ground_pollution.tolist(), sealing.tolist(), d_temp.tolist(), flooded.tolist()
+        ):
+            (cell.air_pollution, cell.ground_pollution, cell.sealing, cell.d_temp, cell.flooded) = (air, ground, seal, temp, is_flooded)
+        for i in changed.tolist():
+            self.set_cell_type(cells[i], BiomType(int(types[i])))
 
-    def _load_seg_map(
-        self,
-        url="./data/jakarta_fake_2.png"
-    ):
-        img_rgba = Image.open(url)
-        img_rgb = img_rgba.convert("RGB")
-        self.seg_map = np.array(img_rgb.rotate(270))
+    def set_cell_type(self, cell: BiomCell, biom_type: BiomType):
+        old_type = cell.type
+        cell.type = biom_type
+        self.biom_grid[cell.pos] = biom_type.value
+        if old_type is not None and old_type != biom_type:
+            self._type_changes.append((*cell.pos, old_type.value))
+
+    def add_type_listener(self, listener):
+        # listener(change: TypeChange) is called once per flush with every cell that changed its type
+        self._type_listeners.append(listener)
 
+    def flush_type_changes(self) -> TypeChange | None:
+        if not len(self._type_changes):
+            return None
+        (x, y, old) = np.array(self._type_changes, dtype=np.int64).T
+        self._type_changes = []
+        # a cell that changed more than once since the last flush counts with its first and its latest type
+        (_, first) = np.unique(x * self.biom_grid.shape[1] + y, return_index=True)
+        (x, y, old) = (x[first], y[first], old[first])
+        new = self.biom_grid[x, y].astype(np.int64)
+        keep = old != new
+        change = TypeChange(x[keep], y[keep], old[keep], new[keep])
+        if len(change):
+            for listener in self._type_listeners:
+                listener(change)
+        return change
 
     def get_cell_pos_of_geom(self, pt: Point):
         return (
-            int(pt.x + (self.raster_layer._width / 2)),
-            int(pt.y + (self.raster_layer._height / 2))
+            math.floor(pt.x + (self.raster_layer.width / 2)),
+            math.floor(pt.y + (self.raster_layer.height / 2))
         )
 
     def get_rel_cell_pos(self, pos):
         return (pos[0] / self.raster_layer._width, pos[1] / self.raster_layer._height)
 
     def is_out_of_map_bounds(self, pt: Point):
-        is_out_of_bounds = False
-        pos = self.get_cell_pos_of_geom(pt)
-        try:
-            cell = self.raster_layer[pos]
-        except:
-           is_out_of_bounds = True
-        return is_out_of_bounds
+        return self.raster_layer.out_of_bounds(self.get_cell_pos_of_geom(pt))
+
+    def remove_agents(self, agents):
+        # drop many agents with a single rtree bulk load instead of one delete per agent
+        for agent in agents:
+            del self._agent_layer.idx.agents[id(agent)]
+        self._recreate_rtree()
+
+    def update_agent_index(self):
+        # bulk-load the rtree from the current agent geometries instead of moving entries one by one
+        self._recreate_rtree()
 
     def _get_cell_biom_type(self, pos: tuple[float,float]) -> BiomType:
         rgb = self.seg_map[pos]
@@ -0,0 +1,122 @@
+import uuid
+import numpy as np
+from shapely.geometry import Point
+from agent import Critter, Species, get_happiness_function
+
+class Spawner:
+    species: list[Species]
+    species_index: dict[Species, int]
+    habitat_cells: dict[Species, np.ndarray]
+    population: np.ndarray
+    init_population: np.ndarray
+    births: int
+    deaths: int
+    rng: np.random.Generator
+
+    def __init__(self, model) -> None:
+        self.model = model
+        self.species = model.tables.species
+        self.species_index = model.tables.species_index
+        self.population = np.zeros(len(self.species), dtype=np.int64)
+        self.init_population = np.zeros(len(self.species), dtype=np.int64)
+        self.births = 0
+        self.deaths = 0
+        self.rng = model.rng
+        self.habitat_cells = {}
+        self._parents = []
+        self.refresh_habitats()
+        model.space.add_type_listener(self.on_type_change)
+
+    def refresh_habitats(self):
+        biom_grid = self.model.space.biom_grid
+        terrain = self.model.space.terrain
+        if terrain is not None:
+            # models on the same terrain with the same flooding share one copy of the habitat cells
+            self.habitat_cells = dict(zip(self.species, terrain.habitat_cells(self.model.tables.habitat, biom_grid)))
+            return
+        for i, species in enumerate(self.species):
+            # (n, 2) array of the x/y grid positions of every cell the species can live in
+            self.habitat_cells[species] = np.argwhere(self.model.tables.habitat[i][biom_grid]).astype(np.int32)
+
+    def on_type_change(self, change):
+        # only the changed cells are added to or dropped from the habitats they entered or left
+        habitat = self.model.tables.habitat
+        height = self.model.space.biom_grid.shape[1]
+        for i, species in enumerate(self.species):
+            (lost, gained) = (habitat[i][change.old] & ~habitat[i][change.new], habitat[i][change.new] & ~habitat[i][change.old])
+            if not lost.any() and not gained.any():
+                continue
+            cells = self.habitat_cells[species]
+            if lost.any():
+                keys = cells[:, 0].astype(np.int64) * height + cells[:, 1]
+                cells = cells[~np.isin(keys, change.x[lost] * height + change.y[lost])]
+            added = np.stack([change.x[gained], change.y[gained]], axis=1).astype(np.int32)
+            self.habitat_cells[species] = np.concatenate([cells, added])
+
+    def spawn_initial(self, n: int) -> list[Critter]:
+        per_species = self.rng.multinomial(n, np.full(len(self.species), 1 / len(self.species)))
+        critters = []
+        for species, count in zip(self.species, per_species):
+            critters += self.spawn_many(species, int(count))
+        return critters
+
+    def spawn_many(self, species: Species, n: int) -> list[Critter]:
+        cells = self.habitat_cells[species]
+        if n <= 0 or not len(cells):
+            return []
+        picks = cells[self.rng.integers(len(cells), size=n)]
+        xs = picks[:, 0] - (self.model.width / 2)
+        ys = picks[:, 1] - (self.model.height / 2)
+        critters = [
+            self._new_critter(species, Point(x, y)) for (x, y) in zip(xs.tolist(), ys.tolist())
+        ]
+        self._add(critters)
+        self.init_population[self.species_index[species]] += len(critters)
+        return critters
+
+    def queue_birth(self, parent: Critter):
+        self._parents.append(parent)
+
+    def flush_births(self) -> list[Critter]:
+        if not len(self._parents):
+            return []
+        offspring = [
+            self._new_critter(parent.species, parent.geometry, is_offspring=True) for parent in self._parents
+        ]
+        self._parents = []
+        self._add(offspring)
+        self.births += len(offspring)
+        return offspring
+
+    def remove(self, critter: Critter):
+        self.population[self.species_index[critter.species]] -= 1
+        self.deaths += 1
+        self.model.schedule.remove(critter)
+
+    def compact(self) -> int:
+        # dead critters are kept in the space until memory runs short, the counters above remember them
+        dead = [critter for critter in self.model.space.agents if not critter.is_alive]
+        if len(dead):
+            self.model.space.remove_agents(dead)
+        return len(dead)
+
+    def _new_critter(self, species: Species, geometry: Point, is_offspring=False) -> Critter:
+        return Critter(
+            unique_id=uuid.uuid4().int,
+            model=self.model,
+            crs=self.model.crs,
+            geometry=geometry,
+            species=species,
+            happinessFunction=get_happiness_function(species),
+            is_offspring=is_offspring
+        )
+
+    def _add(self, critters: list[Critter]):
+        # one bulk rtree load for the whole batch instead of an insert per critter
+        self.model.space.add_agents(critters)
+        for critter in critters:
+            self.model.schedule.add(critter)
+        self.population += np.bincount(
+            [self.species_index[critter.species] for critter in critters],
+            minlength=len(self.species)
+        )
@@ -0,0 +1,19 @@
+// Runs before the MapModule is created: keeps the Leaflet map it makes and
+// sends the map's zoom along with every step and reset request.
+(function () {
+  const createMap = L.map;
+  let map = null;
+  L.map = function () {
+    map = createMap.apply(this, arguments);
+    L.map = createMap;
+    return map;
+  };
+  const sendMessage = ws.send.bind(ws);
+  ws.send = function (msg) {
+    const message = JSON.parse(msg);
+    if (map !== null && (message.type === "get_step" || message.type === "reset")) {
+      message.zoom = map.getZoom();
+    }
+    sendMessage(JSON.stringify(message));
+  };
+})();
@@ -0,0 +1,11 @@
+import os
+import sys
+import pytest
+
+# the modules live at the top of the repo and load their maps relative to it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
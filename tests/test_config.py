@@ -0,0 +1,21 @@
+import json
+import pytest
+import config
+
+def write_config(tmp_path, name: str, data: dict) -> str:
+    path = tmp_path / name
+    path.write_text(json.dumps(data))
+    return str(path)
+
+def test_biom_without_value(tmp_path):
+    bioms = config._load(config.BIOMS_PATH)
+    del bioms["ROCK"]["value"]
+    with pytest.raises(ValueError, match="integer 'value'"):
+        config.load_bioms(write_config(tmp_path, "bioms.json", bioms))
+
+def test_fractional_reproduction_rate(tmp_path):
+    species = config._load(config.SPECIES_PATH)
+    next(iter(species.values()))["reproduction_rate"] = 2.5
+    biom_names = list(config.load_bioms())
+    with pytest.raises(ValueError, match="integer 'reproduction_rate'"):
+        config.load_species(biom_names, write_config(tmp_path, "species.json", species))
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from space import BiomType
+
+STEPS = 4
+FIELDS = ("air_pollution", "ground_pollution", "sealing", "d_temp")
+
+def make_model(seed: int):
+    from model import KinMaking
+    # no critters and no city growth, so only the environment moves
+    return KinMaking(init_num_critters=0, human_expansion_rate=1, sealevel_rise_rate=5, seed=seed)
+
+def environment(model) -> dict:
+    cells = list(model.space.raster_layer)
+    return {
+        "global_temperature": model.global_temperature,
+        "sea_level": model.sea_level,
+        "steps": model.schedule.steps,
+        "bioms": np.bincount(model.space.biom_grid.ravel(), minlength=len(BiomType)).tolist(),
+        "flooded": sum(cell.flooded for cell in cells),
+        **{field: np.mean([getattr(cell, field) for cell in cells]) for field in FIELDS}
+    }
+
+@pytest.fixture(scope="module")
+def stepped_and_advanced():
+    stepped = make_model(seed=1)
+    for _ in range(STEPS):
+        stepped.step()
+    advanced = make_model(seed=2)
+    advanced.advance_environment(STEPS)
+    return (environment(stepped), environment(advanced))
+
+def test_globals_match_exactly(stepped_and_advanced):
+    (stepped, advanced) = stepped_and_advanced
+    for key in ("global_temperature", "sea_level", "steps", "bioms", "flooded"):
+        assert stepped[key] == pytest.approx(advanced[key]), key
+
+def test_cell_means_match(stepped_and_advanced):
+    (stepped, advanced) = stepped_and_advanced
+    for field in FIELDS:
+        assert stepped[field] == pytest.approx(advanced[field], rel=0.01, abs=1e-3), field
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from kernels import (
+    Kernels, numba_available, route_offsets, REPRODUCE, ROAM, DIE, MIGRATE,
+    _classify_neighbors_loop, _pick_destination_loop
+)
+
+needs_numba = pytest.mark.skipif(not numba_available(), reason="numba is not installed")
+
+SEED = 31
+BACKENDS = ["numpy", pytest.param("numba", marks=needs_numba)]
+
+@pytest.fixture(scope="module")
+def backends():
+    return (Kernels("numpy"), Kernels("numba"))
+
+# the baseline Critter.step rules: happy critters reproduce once they have been happy for longer than their
+# reproduction rate and roam until then, unhappy ones die once they have been unhappy for longer than
+# max_steps_unhappy and migrate until then
+NEXT_ACTIONS = [
+    # (is_happy, steps_happy, steps_unhappy, reproduction_rate, max_steps_unhappy, action)
+    (True, 0, 0, 2, 5, ROAM),
+    (True, 2, 0, 2, 5, ROAM),
+    (True, 3, 0, 2, 5, REPRODUCE),
+    (True, 1, 0, 0, 5, REPRODUCE),
+    (True, 0, 9, 2, 5, ROAM),
+    (False, 0, 0, 2, 5, MIGRATE),
+    (False, 0, 5, 2, 5, MIGRATE),
+    (False, 0, 6, 2, 5, DIE),
+    (False, 9, 0, 2, 5, MIGRATE),
+    (False, 0, 1, 2, 0, DIE),
+]
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("is_happy, steps_happy, steps_unhappy, reproduction_rate, max_steps_unhappy, action", NEXT_ACTIONS)
+def test_next_action(backend, is_happy, steps_happy, steps_unhappy, reproduction_rate, max_steps_unhappy, action):
+    kernels = Kernels(backend)
+    assert kernels.next_action(is_happy, steps_happy, steps_unhappy, reproduction_rate, max_steps_unhappy) == action
+
+def test_numpy_classify_neighbors_matches_loop():
+    # the plain python loop numba compiles is the reference for the numpy fallback
+    rng = np.random.default_rng(SEED)
+    kernels = Kernels("numpy")
+    for _ in range(500):
+        relation_row = rng.integers(0, 4, size=10)
+        neighbor_species = rng.integers(0, 10, size=rng.integers(0, 50))
+        np.testing.assert_array_equal(
+            kernels.classify_neighbors(relation_row, neighbor_species),
+            _classify_neighbors_loop(relation_row, neighbor_species)
+        )
+
+@pytest.mark.parametrize("radius", [1, 5])
+def test_numpy_pick_destination_matches_loop(radius):
+    rng = np.random.default_rng(SEED)
+    kernels = Kernels("numpy")
+    biom_grid = rng.integers(0, 12, size=(64, 48)).astype(np.int8)
+    offsets = route_offsets(radius)
+    for _ in range(200):
+        habitat_row = rng.random(12) < rng.random()
+        (x, y) = (int(rng.integers(-10, 74)), int(rng.integers(-10, 58)))
+        u_choice = rng.random()
+        assert kernels.pick_destination(habitat_row, biom_grid, x, y, offsets, u_choice) == \
+            _pick_destination_loop(habitat_row, biom_grid, x, y, offsets, u_choice)
+
+@needs_numba
+def test_classify_neighbors(backends):
+    rng = np.random.default_rng(SEED)
+    (numpy_kernels, numba_kernels) = backends
+    for _ in range(500):
+        relation_row = rng.integers(0, 4, size=10)
+        neighbor_species = rng.integers(0, 10, size=rng.integers(0, 50))
+        np.testing.assert_array_equal(
+            numpy_kernels.classify_neighbors(relation_row, neighbor_species),
+            numba_kernels.classify_neighbors(relation_row, neighbor_species)
+        )
+
+@needs_numba
+@pytest.mark.parametrize("radius", [1, 5, 40])
+def test_pick_destination(backends, radius):
+    rng = np.random.default_rng(SEED)
+    (numpy_kernels, numba_kernels) = backends
+    biom_grid = rng.integers(0, 12, size=(64, 48)).astype(np.int8)
+    offsets = route_offsets(radius)
+    for _ in range(500):
+        habitat_row = rng.random(12) < rng.random()
+        # positions off the map too, as critters only snap back after the move
+        (x, y) = (int(rng.integers(-10, 74)), int(rng.integers(-10, 58)))
+        u_choice = rng.random()
+        assert numpy_kernels.pick_destination(habitat_row, biom_grid, x, y, offsets, u_choice) == \
+            numba_kernels.pick_destination(habitat_row, biom_grid, x, y, offsets, u_choice)
+
+def run_model(backend: str):
+    from model import KinMaking
+    model = KinMaking(init_num_critters=150, kernel_backend=backend, seed=SEED)
+    for _ in range(3):
+        model.step()
+    positions = sorted((critter.geometry.x, critter.geometry.y, critter.is_alive) for critter in model.space.agents)
+    return (model.spawner.population.tolist(), model.spawner.births, model.spawner.deaths, positions)
+
+@needs_numba
+def test_seeded_model_run():
+    assert run_model("numpy") == run_model("numba")
@@ -0,0 +1,32 @@
+import csv
+
+def test_spilled_rows_keep_their_steps(tmp_path):
+    from model import KinMaking
+    spill_path = str(tmp_path / "spill.csv")
+    model = KinMaking(
+        init_num_critters=20, spin_up_steps=3, seed=2,
+        memory_budgets={"collected_data": 0}, memory_check_every=2, spill_path=spill_path
+    )
+    for _ in range(4):
+        model.step()
+    with open(spill_path) as f:
+        rows = list(csv.DictReader(f))
+    # the first row is collected right after the spin-up, then one per step
+    kept = model.datacollector.model_vars["Step"]
+    assert [int(row["Step"]) for row in rows] + kept == list(range(3, 8))
+
+def test_memory_reported_from_the_first_row():
+    from model import KinMaking
+    model = KinMaking(init_num_critters=20, seed=2, memory_check_every=10)
+    assert model.datacollector.model_vars["Memory total (MB)"][0] > 0
+
+def run_seeded(**kwargs):
+    from model import KinMaking
+    model = KinMaking(init_num_critters=600, seed=7, memory_check_every=1, **kwargs)
+    for _ in range(12):
+        model.step()
+    return (model.spawner.population.tolist(), model.spawner.births, model.spawner.deaths)
+
+def test_compaction_leaves_the_run_unchanged():
+    # removing dead critters from the space must not change what the living ones see
+    assert run_seeded(memory_budgets={"critters_dead": 0}) == run_seeded()
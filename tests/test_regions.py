@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+from conftest import ROOT
+
+# BiomType is built from bioms.json on import, so the shuffled config is loaded by a fresh interpreter
+REGION_SIZES = """
+import json
+import numpy as np
+from model import KinMaking
+from space import BiomType
+model = KinMaking(init_num_critters=0, seed=3)
+sizes = model.regions.region_sizes("biom").tolist()
+counts = np.bincount(model.space.biom_grid.ravel(), minlength=len(BiomType))
+print(json.dumps({
+    "reported": dict(zip(model.regions.labels["biom"], sizes)),
+    "expected": {biom_type.name: int(counts[biom_type.value]) for biom_type in BiomType}
+}))
+"""
+
+def test_biom_regions_follow_values_in_shuffled_config(tmp_path):
+    with open(os.path.join(ROOT, "data", "bioms.json")) as f:
+        bioms = json.load(f)
+    path = tmp_path / "bioms.json"
+    path.write_text(json.dumps(dict(reversed(list(bioms.items())))))
+    env = dict(os.environ, KIN_BIOMS_CONFIG=str(path))
+    out = subprocess.run([sys.executable, "-c", REGION_SIZES], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    sizes = json.loads(out.stdout.strip().splitlines()[-1])
+    assert sizes["reported"] == sizes["expected"]
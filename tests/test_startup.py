@@ -0,0 +1,16 @@
+import os
+import headless
+
+# generous ceilings in seconds that only catch gross regressions, tighten them per machine through the environment
+IMPORT_BUDGET = float(os.environ.get("KIN_IMPORT_BUDGET", 15))
+FIRST_TICK_BUDGET = float(os.environ.get("KIN_FIRST_TICK_BUDGET", 15))
+
+def test_startup_times(record_property):
+    timings = headless.measure_startup(init_num_critters=100, seed=1)
+    for key in ("import", "init", "first_tick"):
+        record_property(key, round(timings[key], 3))
+    record_property("visualization_loaded", ",".join(timings["visualization_loaded"]))
+    # the browser front end is never imported by a headless run
+    assert timings["frontend_loaded"] == []
+    assert timings["import"] < IMPORT_BUDGET
+    assert timings["first_tick"] < FIRST_TICK_BUDGET
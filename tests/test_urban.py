@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from urban import biom_lookup
+
+@pytest.fixture(scope="module")
+def grown():
+    from model import KinMaking
+    model = KinMaking(init_num_critters=0, init_sea_level=-60, human_expansion_rate=1.5, seed=5)
+    for _ in range(20):
+        model.urban.step()
+    model.space.flush_type_changes()
+    return model
+
+def test_biom_lookup_skips_unknown_bioms():
+    assert biom_lookup(("URBAN", "NOT_A_BIOM")).sum() == 1
+
+def test_frontier_covers_full_scan(grown):
+    assert grown.urban.converted > 0
+    assert set(np.flatnonzero(grown.urban._frontier_mask()).tolist()) <= grown.urban.frontier
+
+def test_built_up_count_matches_grid(grown):
+    assert grown.urban.built_up_cells == int(grown.urban.built_up[grown.space.biom_grid].sum())
+
+def test_habitats_follow_type_changes(grown):
+    for i, species in enumerate(grown.spawner.species):
+        cells = grown.spawner.habitat_cells[species]
+        expected = np.argwhere(grown.tables.habitat[i][grown.space.biom_grid])
+        assert sorted(map(tuple, cells.tolist())) == sorted(map(tuple, expected.tolist()))
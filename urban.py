@@ -0,0 +1,140 @@
+from functools import partial
+import numpy as np
+from space import BiomCell, BiomType, TypeChange, biom_init_values
+
+# the city grows from built-up cells into the open land next to them, bioms missing from bioms.json are left out
+BUILT_UP = ("URBAN", "ROAD", "INDUSTRIAL")
+GROWS_INTO = ("MEADOW", "FOREST", "PARK")
+
+# von Neumann neighborhood, like kernels.route_offsets(1)
+NEIGHBOR_OFFSETS = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.int64)
+
+def biom_lookup(names: tuple[str, ...]) -> np.ndarray:
+    # True for the BiomType values named, indexable by a biom grid
+    lookup = np.zeros(max(biom_type.value for biom_type in BiomType) + 1, dtype=bool)
+    lookup[[BiomType[name].value for name in names if name in BiomType.__members__]] = True
+    return lookup
+
+def urban_reporter(model, attr: str) -> float:
+    return getattr(model.urban, attr)
+
+class UrbanGrowth:
+    frontier: set[int]
+    built_up_cells: int
+    converted: int
+    last_converted: int
+
+    def __init__(self, model) -> None:
+        self.model = model
+        self.space = model.space
+        (self.width, self.height) = self.space.biom_grid.shape
+        self.built_up = biom_lookup(BUILT_UP)
+        self.grows_into = biom_lookup(GROWS_INTO)
+        (urban, industrial) = (BiomType.__members__.get("URBAN"), BiomType.__members__.get("INDUSTRIAL"))
+        # what a cell next to mostly urban or mostly industrial neighbors becomes
+        self.new_types = (urban if urban is not None else industrial, industrial if industrial is not None else urban)
+        # without built-up land, land to grow into or a type to build, the city stays as it is
+        self.enabled = bool(self.built_up.any() and self.grows_into.any()) and self.new_types[0] is not None
+        # flat x * height + y indices of the open cells next to a built-up one, scanned in full only once
+        self.frontier = set(np.flatnonzero(self._frontier_mask()).tolist()) if self.enabled else set()
+        self.built_up_cells = int(self.built_up[self.space.biom_grid].sum())
+        self.converted = 0
+        self.last_converted = 0
+        self.space.add_type_listener(self.on_type_change)
+
+    @property
+    def expansion_probability(self) -> float:
+        # the share of the frontier built up per step, a rate of 1 or less stops the city from growing
+        return min(max(self.model.human_expansion_rate - 1, 0), 1)
+
+    @property
+    def pct_built_up(self) -> float:
+        return 100 * self.built_up_cells / (self.width * self.height)
+
+    @property
+    def frontier_size(self) -> int:
+        return len(self.frontier)
+
+    def reporters(self) -> dict:
+        return {
+            "Percent Built-up": partial(urban_reporter, attr="pct_built_up"),
+            "Urban Frontier": partial(urban_reporter, attr="frontier_size"),
+            "New Built-up Cells": partial(urban_reporter, attr="last_converted")
+        }
+
+    def step(self) -> int:
+        # cost grows with the frontier, not with the map
+        self.last_converted = 0
+        p = self.expansion_probability
+        if not self.enabled or p <= 0 or not len(self.frontier):
+            return 0
+        candidates = np.fromiter(self.frontier, dtype=np.int64, count=len(self.frontier))
+        picks = candidates[self.model.rng.random(len(candidates)) < p]
+        (x, y) = np.divmod(picks, self.height)
+        types = self.space.biom_grid[x, y]
+        (urban, industrial) = self._built_up_neighbors(x, y)
+        # the frontier is cleaned up lazily: cells that flooded or lost their built-up neighbors just drop out
+        valid = self.grows_into[types] & (urban + industrial > 0)
+        self.frontier.difference_update(picks.tolist())
+
+        cells = self.space.raster_layer.cells
+        for (cx, cy, is_industrial) in zip(x[valid].tolist(), y[valid].tolist(), (industrial > urban)[valid].tolist()):
+            self.build(cells[cx][cy], self.new_types[is_industrial])
+        self._extend_frontier(x[valid], y[valid])
+        self.last_converted = int(valid.sum())
+        self.converted += self.last_converted
+        # every percent of the map the city has grown into adds 0.01 to the pollution rate of all cells
+        self.model.mod_pollution = self.model.init_mod_pollution + self.converted / (self.width * self.height)
+        return self.last_converted
+
+    def build(self, cell: BiomCell, biom_type: BiomType):
+        # the cell keeps what it has accumulated, but is at least as polluted and sealed as new land of its type
+        (old, new) = (biom_init_values[cell.type], biom_init_values[biom_type])
+        cell.air_pollution = max(cell.air_pollution, new["air_pollution"])
+        cell.ground_pollution = max(cell.ground_pollution, new["ground_pollution"])
+        cell.sealing = max(cell.sealing, new["sealing"])
+        cell.d_temp += new["d_temp"] - old["d_temp"]
+        self.space.set_cell_type(cell, biom_type)
+
+    def on_type_change(self, change: TypeChange):
+        # keeps the built-up count and the frontier in step with every type change, including flooding
+        gained = self.built_up[change.new] & ~self.built_up[change.old]
+        lost = self.built_up[change.old] & ~self.built_up[change.new]
+        self.built_up_cells += int(gained.sum()) - int(lost.sum())
+        if not self.enabled:
+            return
+        self._extend_frontier(change.x[gained], change.y[gained])
+        opened = self.grows_into[change.new] & ~self.grows_into[change.old]
+        (urban, industrial) = self._built_up_neighbors(change.x[opened], change.y[opened])
+        self.frontier.update(
+            (change.x[opened] * self.height + change.y[opened])[urban + industrial > 0].tolist()
+        )
+
+    def _extend_frontier(self, x: np.ndarray, y: np.ndarray):
+        # the open neighbors of newly built-up cells
+        nx = (x[:, np.newaxis] + NEIGHBOR_OFFSETS[:, 0]).ravel()
+        ny = (y[:, np.newaxis] + NEIGHBOR_OFFSETS[:, 1]).ravel()
+        inside = (nx >= 0) & (nx < self.width) & (ny >= 0) & (ny < self.height)
+        (nx, ny) = (nx[inside], ny[inside])
+        is_open = self.grows_into[self.space.biom_grid[nx, ny]]
+        self.frontier.update((nx[is_open] * self.height + ny[is_open]).tolist())
+
+    def _built_up_neighbors(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # per cell, the number of URBAN or ROAD and of INDUSTRIAL neighbors
+        urban = np.zeros(len(x), dtype=np.int64)
+        industrial = np.zeros(len(x), dtype=np.int64)
+        industrial_value = BiomType.INDUSTRIAL.value if "INDUSTRIAL" in BiomType.__members__ else -1
+        for (dx, dy) in NEIGHBOR_OFFSETS.tolist():
+            (nx, ny) = (x + dx, y + dy)
+            inside = (nx >= 0) & (nx < self.width) & (ny >= 0) & (ny < self.height)
+            types = np.full(len(x), -1, dtype=np.int64)
+            types[inside] = self.space.biom_grid[nx[inside], ny[inside]]
+            is_industrial = (types == industrial_value) & (types >= 0)
+            industrial += is_industrial
+            urban += (types >= 0) & self.built_up[np.maximum(types, 0)] & ~is_industrial
+        return (urban, industrial)
+
+    def _frontier_mask(self) -> np.ndarray:
+        built_up = np.pad(self.built_up[self.space.biom_grid], 1)
+        next_to_built_up = built_up[:-2, 1:-1] | built_up[2:, 1:-1] | built_up[1:-1, :-2] | built_up[1:-1, 2:]
+        return self.grows_into[self.space.biom_grid] & next_to_built_up